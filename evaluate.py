@@ -10,6 +10,7 @@ import json
 import numpy as np
 from typing import List, Dict
 from pipeline.aggregate import classify_text, classify_text_async
+from pipeline.retrieve_context import prewarm
 import asyncio
 from eval_data import evaluation_data
 
@@ -361,6 +362,9 @@ def main():
     print("Starting evaluation...")
     print("="*80)
     
+    # Build the retriever up front so the first timed example is not a cold start
+    prewarm()
+    
     # Run evaluation
     eval_results = evaluate_system(evaluation_data)
     
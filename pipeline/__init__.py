@@ -5,6 +5,7 @@ Main entry point: classify_text()
 """
 
 from pipeline.aggregate import classify_text, classify_text_async, classify_texts_batch
+from pipeline.retrieve_context import prewarm
 
-__all__ = ['classify_text', 'classify_text_async', 'classify_texts_batch']
+__all__ = ['classify_text', 'classify_text_async', 'classify_texts_batch', 'prewarm']
 
@@ -0,0 +1,44 @@
+# pipeline/_config.py
+"""
+Environment configuration shared by the pipeline modules.
+
+The project's .env file is read at most once per process, however many
+modules need settings from it.
+"""
+
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+from pathlib import Path
+
+
+class ConfigError(RuntimeError):
+    """Required configuration, such as the API key, is missing or invalid.
+
+    Pipeline stages re-raise it instead of returning their fallback results,
+    so a misconfigured deployment fails loudly rather than scoring every text
+    as low-risk.
+    """
+
+
+@lru_cache(maxsize=1)
+def load_env() -> None:
+    """Load the project's .env file into the process environment (once)."""
+    env_path = Path(__file__).resolve().parent.parent / '.env'
+    load_dotenv(dotenv_path=env_path)
+
+
+@lru_cache(maxsize=1)
+def get_api_key() -> str:
+    """Return the OpenRouter API key from the environment or .env file.
+
+    Raises
+    ------
+    ConfigError
+        If OPENROUTER_API_KEY is not set.
+    """
+    load_env()
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ConfigError("OPENROUTER_API_KEY is not set. Add it to the environment or the .env file.")
+    return api_key
@@ -0,0 +1,103 @@
+# pipeline/_json_utils.py
+"""
+Shared helpers for parsing JSON out of LLM responses.
+"""
+
+from typing import Optional
+import orjson
+
+
+def safe_json_load(text: str) -> dict:
+    """Extract and parse the JSON object in a model response.
+
+    Parameters
+    ----------
+    text
+        Raw model output. Usually a bare JSON object, possibly wrapped in a
+        Markdown code fence or surrounded by prose.
+
+    Returns
+    -------
+    dict
+        Parsed JSON object.
+
+    Raises
+    ------
+    ValueError
+        If no JSON object can be parsed from the text.
+    """
+    text = text.strip()
+    # Fast path: the response is already clean JSON. orjson parses in native
+    # code and raises JSONDecodeError (a ValueError) on malformed input
+    if text.startswith('{'):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+
+    # Strip a ```json ... ``` fence before falling back to a full scan
+    if text.startswith("```"):
+        text = text.removeprefix("```json").removeprefix("```")
+        text = text.removesuffix("```").strip()
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+
+    # Widest {...} span: two C-level scans, no regex backtracking
+    start = text.find('{')
+    end = text.rfind('}')
+    if start < 0 or end <= start:
+        raise ValueError("No JSON object found in model output")
+    return orjson.loads(text[start:end + 1])
+
+
+class JsonObjectScanner:
+    """Incrementally detect the end of the first JSON object in streamed text.
+
+    Tracks brace depth while skipping string literals, so a streamed response
+    can be parsed as soon as its top-level object closes instead of waiting
+    for the stream to finish.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.end: Optional[int] = None
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk of text; return True once the object is complete."""
+        if self.end is not None:
+            return True
+        offset = self._length
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        for i, ch in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '{':
+                self._depth += 1
+            elif self._depth:
+                # Quotes in any prose before the object are not string literals
+                if ch == '"':
+                    self._in_string = True
+                elif ch == '}':
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self.end = offset + i + 1
+                        return True
+        return False
+
+    @property
+    def text(self) -> str:
+        """Text received so far, truncated after the object once complete."""
+        text = "".join(self._parts)
+        return text if self.end is None else text[:self.end]
@@ -0,0 +1,339 @@
+# pipeline/_llm.py
+"""
+Shared LLM client for the pipeline modules.
+
+Every module reuses the same ChatOpenAI instance, backed by pooled HTTP
+clients, so concurrent requests share keep-alive (and HTTP/2) connections
+instead of each module opening its own small pool. The client is created
+on the first request, not at import.
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+import weakref
+from typing import Optional
+import httpx
+import openai
+import orjson
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from pipeline._config import ConfigError, get_api_key
+from pipeline._json_utils import JsonObjectScanner
+
+BASE_URL = "https://openrouter.ai/api/v1"
+MODEL = "gpt-4o"
+# JSON mode: the model returns a bare JSON object, so parsing takes the
+# json.loads fast path instead of scanning prose
+_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Sized for classify_texts_batch fan-out; httpx defaults to 10 keep-alive
+# connections, which caps batch throughput
+_HTTP_LIMITS = httpx.Limits(
+    max_connections=200, max_keepalive_connections=200, keepalive_expiry=30.0
+)
+_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Read from the environment (after loading .env) when the client is built:
+# LLM_MAX_CONCURRENCY caps concurrent requests per event loop, since large
+# batches otherwise fire thousands of requests at once and stall in 429
+# backoff; LLM_MAX_RPM is the key's requests-per-minute budget (0 disables
+# pacing), so requests are spaced instead of burning attempts on 429s
+LLM_MAX_CONCURRENCY = None
+LLM_MAX_RPM = None
+
+# Built on first use rather than at import, so processes that never call the
+# LLM skip the .env parse and client construction
+_llm = None
+_http_client = None
+_http_async_client = None
+_pacer = None
+_client_lock = threading.Lock()
+
+
+def _get_llm():
+    """Build the shared client once; concurrent callers wait for the same build.
+
+    Raises
+    ------
+    ConfigError
+        If the client cannot be built, e.g. because the API key is missing.
+    """
+    if _llm is not None:
+        return _llm
+
+    with _client_lock:
+        if _llm is None:
+            try:
+                _build_llm()
+            except ConfigError:
+                raise
+            except Exception as e:
+                raise ConfigError(f"Could not create the LLM client: {e}") from e
+    return _llm
+
+
+def _build_llm():
+    """Load settings and create the pooled HTTP clients and the ChatOpenAI instance."""
+    global LLM_MAX_CONCURRENCY, LLM_MAX_RPM, _llm, _http_client, _http_async_client, _pacer
+    from langchain_openai import ChatOpenAI
+
+    # Loads .env, and fails on a missing key before anything is created, so
+    # repeated calls while misconfigured do not leak clients or exit handlers
+    api_key = get_api_key()
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+    LLM_MAX_RPM = int(os.getenv("LLM_MAX_RPM", "0"))
+    _pacer = _RequestPacer(LLM_MAX_RPM)
+
+    http_client = httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT, http2=True)
+    http_async_client = httpx.AsyncClient(
+        limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT, http2=True
+    )
+    try:
+        llm = ChatOpenAI(
+            api_key=api_key,
+            base_url=BASE_URL,
+            model=MODEL,
+            temperature=0,
+            model_kwargs={"response_format": _RESPONSE_FORMAT},
+            # _retry_transient is the only retry layer; the client's own retries
+            # would multiply attempts and sleep while holding a semaphore slot
+            max_retries=0,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+    except Exception:
+        # Nothing has been sent yet; the async client holds no connections
+        http_client.close()
+        raise
+
+    _http_client, _http_async_client = http_client, http_async_client
+    atexit.register(_close_http_clients)
+    # Assigned last: a non-None _llm marks the client as ready
+    _llm = llm
+
+
+def _close_http_clients():
+    """Close the pooled HTTP clients at interpreter exit."""
+    _http_client.close()
+    try:
+        asyncio.run(_http_async_client.aclose())
+    except Exception:
+        # Connections opened on a loop that is already gone cannot be closed
+        # cleanly; the process is exiting anyway
+        pass
+
+
+# asyncio primitives are bound to the loop they first wait on, and the sync
+# wrappers create a fresh loop per call, so keep one semaphore per loop
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Return the request semaphore for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return semaphore
+
+
+class _RequestPacer:
+    """Space request starts evenly to stay under a requests-per-minute limit.
+
+    Each caller reserves the next free start slot under a thread lock and
+    then sleeps until it, so the pacer works across event loops and from
+    synchronous code alike.
+    """
+
+    def __init__(self, requests_per_minute: int):
+        self._interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Claim the next start slot and return how long to wait for it."""
+        if not self._interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        return slot - now
+
+    async def acquire(self):
+        """Wait for a request slot (async version)."""
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self):
+        """Wait for a request slot (synchronous version)."""
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Whether a failed LLM request is worth retrying (network, 429 or 5xx)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, (
+        httpx.TransportError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    ))
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait via a Retry-After header, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("retry-after", "")))
+    except ValueError:
+        # HTTP-date form or missing header; fall back to backoff
+        return None
+
+
+# Longest wait between attempts, whether from backoff or Retry-After. Jittered
+# backoff keeps a batch's failed requests from retrying in lockstep
+RETRY_MAX_WAIT = 20.0
+_backoff = wait_exponential_jitter(initial=0.5, max=RETRY_MAX_WAIT, jitter=1)
+
+
+def _wait_for_retry(retry_state) -> float:
+    """Honor Retry-After (capped at RETRY_MAX_WAIT), else back off with jitter."""
+    exc = retry_state.outcome.exception()
+    delay = _retry_after(exc) if exc is not None else None
+    if delay is None:
+        return _backoff(retry_state)
+    return min(delay, RETRY_MAX_WAIT)
+
+
+_retry_transient = retry(
+    retry=retry_if_exception(_is_transient),
+    stop=stop_after_attempt(5),
+    wait=_wait_for_retry,
+    reraise=True,
+)
+
+
+@_retry_transient
+async def chat_completion(messages: list[dict]) -> str:
+    """Stream a chat completion directly from the OpenAI-compatible endpoint.
+
+    Posts to /chat/completions on the shared pooled client, bypassing the
+    LangChain and OpenAI client layers, and reads the server-sent event
+    stream only until the response's JSON object closes.
+
+    Parameters
+    ----------
+    messages
+        Chat messages as {"role": ..., "content": ...} dicts.
+
+    Returns
+    -------
+    str
+        Message content up to the end of its first top-level JSON object, or
+        the full content if no complete object was seen.
+    """
+    payload = {
+        "model": MODEL,
+        "temperature": 0,
+        "response_format": _RESPONSE_FORMAT,
+        "messages": messages,
+        "stream": True,
+    }
+    headers = {"Authorization": f"Bearer {get_api_key()}"}
+    scanner = JsonObjectScanner()
+    _get_llm()
+    async with _get_semaphore():
+        await _pacer.acquire()
+        async with _http_async_client.stream(
+            "POST", f"{BASE_URL}/chat/completions", json=payload, headers=headers
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Skip keep-alive comments and blank separators
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices")
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta and scanner.feed(delta):
+                    break
+    return scanner.text
+
+
+@_retry_transient
+async def astream_json(messages) -> str:
+    """Stream a chat completion and return its text once the JSON object closes.
+
+    At most LLM_MAX_CONCURRENCY requests run at once per event loop; further
+    callers wait for a free slot. Request starts are paced to LLM_MAX_RPM
+    when it is set. Transient network, rate-limit and server errors are
+    retried with jittered exponential backoff, or after the server's
+    Retry-After delay when one is given.
+
+    Parameters
+    ----------
+    messages
+        Chat messages to send to the model.
+
+    Returns
+    -------
+    str
+        Model output up to the end of its first top-level JSON object, or the
+        full output if no complete object was seen.
+    """
+    scanner = JsonObjectScanner()
+    llm = _get_llm()
+    async with _get_semaphore():
+        await _pacer.acquire()
+        stream = llm.astream(messages)
+        try:
+            async for chunk in stream:
+                if scanner.feed(chunk.content):
+                    break
+        finally:
+            # Stop reading (and release the connection) once the object is complete
+            await stream.aclose()
+    return scanner.text
+
+
+@_retry_transient
+def stream_json(messages) -> str:
+    """Stream a chat completion and return its text once the JSON object closes (synchronous version).
+
+    Parameters
+    ----------
+    messages
+        Chat messages to send to the model.
+
+    Returns
+    -------
+    str
+        Model output up to the end of its first top-level JSON object, or the
+        full output if no complete object was seen.
+    """
+    scanner = JsonObjectScanner()
+    llm = _get_llm()
+    _pacer.acquire_sync()
+    stream = llm.stream(messages)
+    try:
+        for chunk in stream:
+            if scanner.feed(chunk.content):
+                break
+    finally:
+        stream.close()
+    return scanner.text
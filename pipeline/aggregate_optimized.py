@@ -4,43 +4,219 @@ Optimized classification pipeline with async/parallel processing and caching.
 
 This module provides the core classification functionality with:
 - Parallel execution of independent operations
-- In-memory caching for repeated queries
+- In-memory LRU caching for repeated queries, with an optional on-disk tier
 - Batch processing support
 - Graceful error handling
 """
 
 import asyncio
 import hashlib
-from typing import Dict, Optional
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+from pipeline._config import ConfigError, load_env
 from pipeline.extract_claim_async import extract_claim_async
-from pipeline.retrieve_context import retrieve_context
+from pipeline.retrieve_context import retrieve_context_async
 from pipeline.map_trope_async import map_trope_async
 from pipeline.counterfactual_async import counterfactual_test_async
+from pipeline.combined_analysis import combined_analysis_async
 
+try:
+    import diskcache
+    HAS_DISKCACHE = True
+except ImportError:
+    HAS_DISKCACHE = False
 
-# Simple in-memory cache (can be upgraded to Redis for production)
-_cache: Dict[str, Dict] = {}
+
+# In-memory cache (can be upgraded to Redis for production). Benign texts
+# dominate moderation traffic, so low-risk results go to a separate, larger
+# FIFO tier and cannot evict the high-risk/ambiguous results held in the LRU
+# tier, whose misses are the costly ones to recompute.
+_cache_hot: "OrderedDict[Union[str, bytes], Dict]" = OrderedDict()
+_cache_cold: "OrderedDict[Union[str, bytes], Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
 CACHE_SIZE = 1000
+COLD_CACHE_SIZE = 10000
+# Texts up to this many characters are used as their own cache key
+CACHE_KEY_MAX_RAW_LEN = 512
+
+# Optional on-disk tier behind the in-memory cache, shared across worker
+# processes and restarts. Enabled by pointing BLUESQUARE_DISK_CACHE_DIR at a
+# writable directory (requires diskcache); opened on first cache use, so
+# importing the pipeline does not read .env
+DISK_CACHE_SIZE_LIMIT = 2 ** 31
+# Disk entries expire after a week, and keys carry CACHE_VERSION so that
+# bumping it (on any prompt, model or scoring change) retires old verdicts
+DISK_CACHE_EXPIRE = 7 * 24 * 60 * 60
+CACHE_VERSION = 2
+_disk_cache = None
+_disk_cache_opened = False
+_disk_cache_lock = threading.Lock()
+
+# Event loop that runs classify_text() calls, started on first use
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+# When True, counterfactual testing and trope mapping share one LLM call
+# (see pipeline.combined_analysis) instead of running as separate requests
+USE_COMBINED_ANALYSIS = False
+
+# Token-set Jaccard similarity between the extracted claim and the raw text
+# above which documents retrieved for the raw text are reused for the claim
+RETRIEVAL_REUSE_SIMILARITY = 0.7
+
+# Risk score multipliers; anything not listed falls back to the default
+# passed to .get() at the call site
+_TARGET_MULTIPLIERS = {"explicit_jews": 1.2, "implicit_jews": 1.0}
+_EXPLICITNESS_MULTIPLIERS = {"explicit": 1.1}
+
+# (exclusive lower bound, verdict), checked from highest to lowest
+_VERDICT_THRESHOLDS = (
+    (0.6, "High-risk trope-based rhetoric"),
+    (0.3, "Ambiguous — requires context"),
+)
+_LOW_RISK_VERDICT = "Low-risk / non-identity-based"
+
+# Classifications currently running, keyed like the cache, so concurrent
+# requests for the same text share a single pipeline run
+_inflight: Dict[Union[str, bytes], asyncio.Task] = {}
+
+
+def _get_cache_key(text: str) -> Union[str, bytes]:
+    """Generate cache key from text.
+
+    Short texts are used directly: str objects cache their own hash, so the
+    dict probe is cheaper than computing a digest. Longer texts are reduced
+    to a 128-bit BLAKE2 digest: collisions must stay out of reach, since a
+    colliding text would be served another text's verdict, and the key must
+    not depend on which optional packages a worker has installed.
+    """
+    if len(text) <= CACHE_KEY_MAX_RAW_LEN:
+        return text
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def _normalize_text(text: str) -> str:
+    """Collapse whitespace runs and lowercase text for cache keying."""
+    return " ".join(text.split()).lower()
+
+
+def _token_jaccard(a: str, b: str) -> float:
+    """Jaccard similarity of the lowercased token sets of two strings."""
+    tokens_a = set(a.lower().split())
+    tokens_b = set(b.lower().split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+def _get_disk_cache():
+    """Return the on-disk cache tier, opening it on first use (None when disabled)."""
+    global _disk_cache, _disk_cache_opened
+    if _disk_cache_opened:
+        return _disk_cache
+
+    with _disk_cache_lock:
+        if not _disk_cache_opened:
+            load_env()
+            disk_cache_dir = os.getenv("BLUESQUARE_DISK_CACHE_DIR")
+            if disk_cache_dir:
+                if HAS_DISKCACHE:
+                    _disk_cache = diskcache.Cache(disk_cache_dir, size_limit=DISK_CACHE_SIZE_LIMIT)
+                else:
+                    print("Warning: diskcache not available. On-disk result cache is disabled.")
+            _disk_cache_opened = True
+    return _disk_cache
+
 
+def _disk_cache_disabled() -> bool:
+    """Whether the on-disk tier is known to be disabled (without opening it)."""
+    return _disk_cache_opened and _disk_cache is None
 
-def _get_cache_key(text: str) -> str:
-    """Generate cache key from text."""
-    return hashlib.md5(text.encode()).hexdigest()
 
+def _get_from_disk_cache(key: Union[str, bytes]) -> Optional[Dict]:
+    """Get result from the on-disk tier, if enabled. Blocks on SQLite."""
+    disk_cache = _get_disk_cache()
+    if disk_cache is None:
+        return None
+    return disk_cache.get((CACHE_VERSION, key))
 
-def _get_from_cache(text: str) -> Optional[Dict]:
-    """Get result from cache."""
-    key = _get_cache_key(text)
-    return _cache.get(key)
 
+def _set_disk_cache(key: Union[str, bytes], result: Dict):
+    """Set result in the on-disk tier, if enabled. Blocks on SQLite."""
+    disk_cache = _get_disk_cache()
+    if disk_cache is not None:
+        disk_cache.set((CACHE_VERSION, key), result, expire=DISK_CACHE_EXPIRE)
 
-def _set_cache(text: str, result: Dict):
-    """Set result in cache."""
-    key = _get_cache_key(text)
-    if len(_cache) >= CACHE_SIZE:
-        # Remove oldest entry (simple FIFO)
-        _cache.pop(next(iter(_cache)))
-    _cache[key] = result
+
+async def _get_from_cache(key: Union[str, bytes]) -> Optional[Dict]:
+    """Get result from cache, probing the hot tier, the cold tier, then disk.
+
+    The disk probe runs in the default executor: SQLite can busy-wait while
+    other workers write, which must not stall the event loop.
+    """
+    with _cache_lock:
+        result = _cache_hot.get(key)
+        if result is not None:
+            _cache_hot.move_to_end(key)
+            return result
+        result = _cache_cold.get(key)
+        if result is not None:
+            return result
+    if _disk_cache_disabled():
+        return None
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, _get_from_disk_cache, key)
+    if result is not None:
+        _set_memory_cache(key, result)
+    return result
+
+
+async def _set_cache(key: Union[str, bytes], result: Dict):
+    """Set result in memory and, when enabled, in the on-disk tier (off the event loop)."""
+    _set_memory_cache(key, result)
+    if not _disk_cache_disabled():
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _set_disk_cache, key, result)
+
+
+def _set_memory_cache(key: Union[str, bytes], result: Dict):
+    """Set result in the in-memory tier matching its verdict.
+
+    Low-risk results go to the cold tier (FIFO); everything else goes to the
+    hot tier (LRU). Either tier evicts its oldest entry when full.
+    """
+    if result["verdict"] == _LOW_RISK_VERDICT:
+        cache, other, size = _cache_cold, _cache_hot, COLD_CACHE_SIZE
+    else:
+        cache, other, size = _cache_hot, _cache_cold, CACHE_SIZE
+    with _cache_lock:
+        other.pop(key, None)
+        if key in cache:
+            cache.move_to_end(key)
+        elif len(cache) >= size:
+            cache.popitem(last=False)
+        cache[key] = result
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the long-lived event loop used by classify_text(), starting it on first use.
+
+    Reusing one loop keeps the LLM client's connection pool (and TLS sessions)
+    alive across synchronous calls; asyncio.run() would tear them down on
+    every call.
+    """
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_background_loop.run_forever,
+                name="classify_text-loop",
+                daemon=True,
+            ).start()
+        return _background_loop
 
 
 async def classify_text_async(text: str, use_cache: bool = True) -> dict:
@@ -51,7 +227,10 @@ async def classify_text_async(text: str, use_cache: bool = True) -> dict:
     text
         Input text to analyze for antisemitic rhetoric.
     use_cache
-        If True, use in-memory cache for repeated queries (default: True).
+        If True, use in-memory cache for repeated queries and share a single
+        pipeline run between concurrent calls for the same text. Texts that
+        differ only in whitespace or case share a cache entry
+        (default: True).
 
     Returns
     -------
@@ -64,60 +243,143 @@ async def classify_text_async(text: str, use_cache: bool = True) -> dict:
         - explanation: Alternative non-antisemitic interpretation
         - reasoning: Brief explanation of assessment
         - details: Additional analysis details
+        - error: Present only if a pipeline stage failed; such results
+          are not cached
     """
-    # Check cache first
-    if use_cache:
-        cached = _get_from_cache(text)
-        if cached:
-            return cached
-    
-    # Early exit: very short or obviously benign text
-    if len(text.strip()) < 10:
-        result = {
-            "verdict": "Low-risk / non-identity-based",
-            "risk_score": 0.0,
-            "trope": "none",
-            "trope_strength": 0.0,
-            "explanation": "Text too short for meaningful analysis.",
-            "reasoning": "",
-            "details": {
-                "extracted_claim": text,
-                "target": "unclear",
-                "explicitness": "implicit",
-                "counterfactual": "",
-                "meaning_preserved": True,
-                "counterfactual_explanation": ""
-            }
-        }
-        if use_cache:
-            _set_cache(text, result)
+    # Normalize whitespace and case so trivially different copies of the
+    # same text share a cache entry
+    normalized = _normalize_text(text)
+
+    # Early exit: very short or obviously benign text, before any hashing
+    if len(normalized) < 10:
+        return _short_text_result(text)
+
+    if not use_cache:
+        return await _classify_text(text)
+
+    key = _get_cache_key(normalized)
+    cached = await _get_from_cache(key)
+    if cached:
+        return cached
+
+    # Coalesce with an identical request already running on this loop; a
+    # task cannot be awaited from a different loop. The run is its own task
+    # and every caller shields it, so cancelling one caller (e.g. a client
+    # disconnecting) leaves the run going for the others
+    loop = asyncio.get_running_loop()
+    task = _inflight.get(key)
+    if task is None or task.get_loop() is not loop:
+        task = loop.create_task(_classify_and_cache(key, text))
+        _inflight[key] = task
+    return await asyncio.shield(task)
+
+
+async def _classify_and_cache(key: Union[str, bytes], text: str) -> dict:
+    """Run the pipeline for text and cache the result under key.
+
+    Results from a run where any stage failed are returned but not cached,
+    so a transient outage cannot pin its fallback verdict.
+    """
+    try:
+        result = await _classify_text(text)
+        if "error" not in result:
+            await _set_cache(key, result)
         return result
-    
+    finally:
+        if _inflight.get(key) is asyncio.current_task():
+            del _inflight[key]
+
+
+def _short_text_result(text: str) -> dict:
+    """Build the low-risk result returned for text too short to analyze."""
+    return {
+        "verdict": _LOW_RISK_VERDICT,
+        "risk_score": 0.0,
+        "trope": "none",
+        "trope_strength": 0.0,
+        "explanation": "Text too short for meaningful analysis.",
+        "reasoning": "",
+        "details": {
+            "extracted_claim": text,
+            "target": "unclear",
+            "explicitness": "implicit",
+            "counterfactual": "",
+            "meaning_preserved": True,
+            "counterfactual_explanation": ""
+        }
+    }
+
+
+async def _cancel_tasks(tasks: list):
+    """Cancel unfinished tasks and wait for all of them, retrieving their exceptions."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _classify_text(text: str) -> dict:
+    """Run the full classification pipeline for text, bypassing the cache."""
+    # Stage tasks started below; any still running when a stage raises are
+    # cancelled and awaited so their outcomes are not left unobserved
+    tasks = []
     # Run independent operations in parallel
     try:
-        # These can all run in parallel since they don't depend on each other
-        claim_task = extract_claim_async(text)
-        counterfactual_task = counterfactual_test_async(text)
+        if USE_COMBINED_ANALYSIS:
+            # Retrieve against the raw text while the claim is extracted, then
+            # run counterfactual testing and trope mapping in one LLM call
+            tasks += [
+                asyncio.create_task(extract_claim_async(text)),
+                asyncio.create_task(retrieve_context_async(text)),
+            ]
+            claim_data, docs = await asyncio.gather(*tasks)
+            claim = claim_data.get("claim", text)
+            target = claim_data.get("target", "unclear")
+            explicitness = claim_data.get("explicitness", "implicit")
+
+            trope_map = await combined_analysis_async(text, claim, docs)
+            counterfactual_task_result = {
+                "counterfactual_claim": trope_map.get("counterfactual_claim", ""),
+                "meaning_preserved": trope_map.get("meaning_preserved", True),
+                "explanation": trope_map.get("counterfactual_explanation", "")
+            }
+        else:
+            # These can all run in parallel since they don't depend on each other.
+            # Retrieval is started speculatively against the raw text: the
+            # extracted claim is usually a near-copy of it
+            claim_task = asyncio.create_task(extract_claim_async(text))
+            counterfactual_task = asyncio.create_task(counterfactual_test_async(text))
+            prefetch_task = asyncio.create_task(retrieve_context_async(text))
+            tasks += [claim_task, counterfactual_task, prefetch_task]
         
-        # Wait for claim extraction first (needed for retrieval)
-        claim_data = await claim_task
-        claim = claim_data.get("claim", text)
-        target = claim_data.get("target", "unclear")
-        explicitness = claim_data.get("explicitness", "implicit")
+            # Wait for claim extraction first (needed to validate retrieval)
+            claim_data = await claim_task
+            claim = claim_data.get("claim", text)
+            target = claim_data.get("target", "unclear")
+            explicitness = claim_data.get("explicitness", "implicit")
         
-        # Now run retrieval and counterfactual in parallel
-        # retrieve_context is synchronous, so run it in thread pool
-        docs_task = asyncio.to_thread(retrieve_context, claim)
-        counterfactual_task_result = await counterfactual_task
+            # Reuse the prefetched docs unless the claim diverged from the text
+            if _token_jaccard(claim, text) > RETRIEVAL_REUSE_SIMILARITY:
+                docs_task = prefetch_task
+            else:
+                prefetch_task.cancel()
+                docs_task = asyncio.create_task(retrieve_context_async(claim))
+                tasks.append(docs_task)
+            counterfactual_task_result = await counterfactual_task
         
-        # Wait for retrieval (runs in parallel with counterfactual)
-        docs = await docs_task
+            # Wait for retrieval (runs in parallel with counterfactual)
+            docs = await docs_task
         
-        # Now run trope mapping (needs docs)
-        trope_map = await map_trope_async(claim, docs)
+            # Now run trope mapping (needs docs)
+            trope_map = await map_trope_async(claim, docs)
         
+    except ConfigError:
+        # Misconfiguration must surface, not score as low-risk
+        await _cancel_tasks(tasks)
+        raise
     except Exception as e:
         # Fallback on error
+        await _cancel_tasks(tasks)
+        error = str(e)
         claim = text
         target = "unclear"
         explicitness = "implicit"
@@ -133,69 +395,66 @@ async def classify_text_async(text: str, use_cache: bool = True) -> dict:
             "explanation": f"Error: {str(e)}"
         }
         docs = []
+    else:
+        # Stages catch their own failures and return defaults with an "error"
+        error = next(
+            (
+                stage["error"]
+                for stage in (claim_data, counterfactual_task_result, trope_map)
+                if "error" in stage
+            ),
+            None,
+        )
 
-    # Calculate risk score (same logic as before)
+    # Read every field once; the score and the result below use the locals
     trope_strength = trope_map.get("trope_strength", 0.0)
-    meaning_preserved = counterfactual_task_result.get("meaning_preserved", True)
     mapped_trope = trope_map.get("mapped_trope", "none")
+    alternative_interpretation = trope_map.get(
+        "alternative_interpretation",
+        "No clear identity-based implication detected."
+    )
+    reasoning = trope_map.get("reasoning", "")
+    meaning_preserved = counterfactual_task_result.get("meaning_preserved", True)
+    counterfactual_claim = counterfactual_task_result.get("counterfactual_claim", "")
+    counterfactual_explanation = counterfactual_task_result.get("explanation", "")
 
     # Improved risk score calculation
     base_score = trope_strength
-    
-    if meaning_preserved:
-        counterfactual_multiplier = 0.3
-    else:
-        counterfactual_multiplier = 1.0
-    
-    if target == "explicit_jews":
-        target_multiplier = 1.2
-    elif target == "implicit_jews":
-        target_multiplier = 1.0
-    else:
-        target_multiplier = 0.8
-    
-    if explicitness == "explicit":
-        explicitness_multiplier = 1.1
-    else:
-        explicitness_multiplier = 1.0
-    
+    counterfactual_multiplier = 0.3 if meaning_preserved else 1.0
+    target_multiplier = _TARGET_MULTIPLIERS.get(target, 0.8)
+    explicitness_multiplier = _EXPLICITNESS_MULTIPLIERS.get(explicitness, 1.0)
+
     risk_score = min(1.0, base_score * counterfactual_multiplier * target_multiplier * explicitness_multiplier)
     
     if mapped_trope != "none" and trope_strength > 0.7:
         if meaning_preserved:
             risk_score = max(risk_score, trope_strength * 0.5)
 
-    if risk_score > 0.6:
-        verdict = "High-risk trope-based rhetoric"
-    elif risk_score > 0.3:
-        verdict = "Ambiguous — requires context"
-    else:
-        verdict = "Low-risk / non-identity-based"
+    verdict = _LOW_RISK_VERDICT
+    for threshold, label in _VERDICT_THRESHOLDS:
+        if risk_score > threshold:
+            verdict = label
+            break
 
     result = {
         "verdict": verdict,
         "risk_score": round(risk_score, 2),
         "trope": mapped_trope,
         "trope_strength": round(trope_strength, 2),
-        "explanation": trope_map.get(
-            "alternative_interpretation",
-            "No clear identity-based implication detected."
-        ),
-        "reasoning": trope_map.get("reasoning", ""),
+        "explanation": alternative_interpretation,
+        "reasoning": reasoning,
         "details": {
             "extracted_claim": claim,
             "target": target,
             "explicitness": explicitness,
-            "counterfactual": counterfactual_task_result.get("counterfactual_claim", ""),
+            "counterfactual": counterfactual_claim,
             "meaning_preserved": meaning_preserved,
-            "counterfactual_explanation": counterfactual_task_result.get("explanation", "")
+            "counterfactual_explanation": counterfactual_explanation
         }
     }
-    
-    # Cache result
-    if use_cache:
-        _set_cache(text, result)
-    
+    if error is not None:
+        result["error"] = error
+
     return result
 
 
@@ -221,22 +480,20 @@ def classify_text(text: str, use_cache: bool = True) -> dict:
         - reasoning: Brief explanation of assessment
         - details: Additional analysis details
     """
+    loop = _get_background_loop()
     try:
-        # Check if we're in an async context (e.g., Jupyter notebook)
-        loop = asyncio.get_running_loop()
-        # If we're in an async context, try to use nest_asyncio
-        try:
-            import nest_asyncio
-            nest_asyncio.apply()
-            return asyncio.run(classify_text_async(text, use_cache))
-        except ImportError:
-            raise RuntimeError(
-                "classify_text() cannot be called from an async context. "
-                "Install nest-asyncio (pip install nest-asyncio) or use await classify_text_async() instead."
-            )
+        running = asyncio.get_running_loop()
     except RuntimeError:
-        # No running loop, safe to use asyncio.run()
-        return asyncio.run(classify_text_async(text, use_cache))
+        running = None
+    if running is loop:
+        # Blocking here would deadlock the loop the coroutine needs to run on
+        raise RuntimeError(
+            "classify_text() cannot be called from the pipeline's background loop. "
+            "Use await classify_text_async() instead."
+        )
+    # Safe from a running loop too (e.g., Jupyter notebook): the coroutine
+    # runs on the background loop while this thread waits for the result
+    return asyncio.run_coroutine_threadsafe(classify_text_async(text, use_cache), loop).result()
 
 
 async def classify_texts_batch(texts: list[str], use_cache: bool = True) -> list[dict]:
@@ -253,8 +510,24 @@ async def classify_texts_batch(texts: list[str], use_cache: bool = True) -> list
     -------
     list[dict]
         List of classification results, one per input text. Each result
-        contains the same structure as classify_text_async().
+        contains the same structure as classify_text_async(). Texts that
+        differ only in whitespace or case are classified once and share a
+        result.
     """
-    tasks = [classify_text_async(text, use_cache) for text in texts]
-    return await asyncio.gather(*tasks)
+    # Classify each distinct (normalized) text once, then fan results back out
+    # to every position it appeared in
+    unique_index: Dict[str, int] = {}
+    unique_texts = []
+    positions = []
+    for text in texts:
+        normalized = _normalize_text(text)
+        index = unique_index.get(normalized)
+        if index is None:
+            index = unique_index[normalized] = len(unique_texts)
+            unique_texts.append(text)
+        positions.append(index)
+
+    tasks = [classify_text_async(text, use_cache) for text in unique_texts]
+    results = await asyncio.gather(*tasks)
+    return [results[index] for index in positions]
 
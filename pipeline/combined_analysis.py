@@ -0,0 +1,154 @@
+# pipeline/combined_analysis.py
+"""
+Combined counterfactual and trope analysis module.
+
+Runs counterfactual testing and trope mapping in a single LLM request, so the
+uncached pipeline needs two model round-trips (claim extraction + this call)
+instead of three. The standalone counterfactual and trope modules are kept
+for callers that need them individually.
+"""
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from pipeline._config import ConfigError
+from pipeline._json_utils import safe_json_load
+from pipeline._llm import astream_json
+
+SYSTEM_PROMPT = """
+You are a reasoning agent specialized in detecting identity-based implications and
+identifying antisemitic tropes.
+
+You perform two analyses of the same text:
+
+1. Counterfactual test: rewrite the text using neutral, non-identity-based actors
+   (e.g., "powerful groups", "certain individuals", "institutions") and decide whether
+   its core meaning survives. If the meaning is lost or fundamentally changed when
+   identity is removed, the text likely depends on implicit identity assumptions.
+
+2. Trope mapping: determine whether the extracted claim resembles a known antisemitic
+   trope, using ONLY the provided reference material.
+
+You must:
+- Ground your trope reasoning in the reference material
+- Allow for ambiguity and context
+- Always provide a plausible non-antisemitic interpretation
+- Consider both explicit and implicit (coded) language
+- Be precise in your trope_strength assessment
+
+If the claim does not clearly match any trope, return "none" with trope_strength 0.0.
+"""
+
+HUMAN_PROMPT = """
+Original text:
+"{text}"
+
+Extracted claim:
+"{claim}"
+
+Reference material:
+{context}
+
+Instructions:
+1. Rewrite the original text using neutral, non-identity-based actors and compare it to the original.
+2. Decide whether the original meaning depends on an implied identity group.
+3. Determine whether the claim resembles a known antisemitic trope from the available options.
+4. Estimate how strong the resemblance is on a scale from 0.0 to 1.0:
+   - 0.0-0.2: No clear resemblance or very weak
+   - 0.3-0.5: Some resemblance but ambiguous
+   - 0.6-0.8: Strong resemblance with some ambiguity
+   - 0.9-1.0: Clear, strong resemblance
+5. Provide a plausible alternative interpretation that is NOT antisemitic.
+
+Available tropes:
+- elite_control: Claims about Jews controlling institutions (media, finance, government)
+- dual_loyalty: Claims about divided allegiance or loyalty conflicts
+- collective_guilt: Holding all Jews responsible for actions of individuals/Israel
+- financial_conspiracy: Financial manipulation conspiracies targeting Jews
+- blood_libel: Accusations of harm or ritualistic violence
+- holocaust_denial: Denial, minimization, or distortion of the Holocaust
+- proxy_figures: Using specific individuals as stand-ins for broader conspiracies
+- dogwhistle: Coded language that may convey antisemitic meaning
+- religious_demonization: Framing Jews as evil or satanic
+- none: No clear trope match
+
+Return ONLY valid JSON with the following fields:
+- counterfactual_claim (string)
+- meaning_preserved (true | false)
+- counterfactual_explanation (string, explain why meaning is or isn't preserved)
+- mapped_trope (elite_control | dual_loyalty | collective_guilt | financial_conspiracy | blood_libel | holocaust_denial | proxy_figures | dogwhistle | religious_demonization | none)
+- trope_strength (number between 0.0 and 1.0)
+- alternative_interpretation (string)
+- reasoning (string, brief explanation of your trope assessment)
+"""
+
+_SYSTEM_MSG = SystemMessage(content=SYSTEM_PROMPT)
+
+
+async def combined_analysis_async(text: str, claim: str, retrieved_docs) -> dict:
+    """Run counterfactual testing and trope mapping in one LLM call (async version).
+
+    Parameters
+    ----------
+    text
+        Original input text, rewritten for the counterfactual test.
+    claim
+        Extracted claim text, mapped against known tropes.
+    retrieved_docs
+        List of retrieved knowledge base documents from RAG system.
+
+    Returns
+    -------
+    dict
+        Combined result containing:
+        - counterfactual_claim: Rewritten text with neutral actors
+        - meaning_preserved: Whether meaning is preserved in counterfactual (bool)
+        - counterfactual_explanation: Why meaning is or isn't preserved
+        - mapped_trope: Detected trope type or "none"
+        - trope_strength: Strength of match (0.0-1.0)
+        - alternative_interpretation: Plausible non-antisemitic interpretation
+        - reasoning: Brief explanation of assessment
+    """
+    context = "\n\n".join(
+        [doc.text if hasattr(doc, "text") else str(doc) for doc in retrieved_docs]
+    )
+
+    try:
+        content = await astream_json([
+            _SYSTEM_MSG,
+            HumanMessage(content=HUMAN_PROMPT.format(text=text, claim=claim, context=context)),
+        ])
+        return safe_json_load(content)
+    except ConfigError:
+        # Misconfiguration must surface, not score as low-risk
+        raise
+    except Exception as e:
+        return {
+            "counterfactual_claim": "",
+            "meaning_preserved": True,  # Default to preserved (lower risk)
+            "counterfactual_explanation": f"Unable to determine due to error: {str(e)}",
+            "mapped_trope": "none",
+            "trope_strength": 0.0,
+            "alternative_interpretation": "Unable to determine due to parsing error.",
+            "reasoning": f"Error: {str(e)}",
+            "error": str(e)
+        }
+
+
+def combined_analysis(text: str, claim: str, retrieved_docs) -> dict:
+    """Run counterfactual testing and trope mapping in one LLM call (synchronous wrapper).
+
+    Parameters
+    ----------
+    text
+        Original input text, rewritten for the counterfactual test.
+    claim
+        Extracted claim text, mapped against known tropes.
+    retrieved_docs
+        List of retrieved knowledge base documents from RAG system.
+
+    Returns
+    -------
+    dict
+        Combined result with the same fields as combined_analysis_async().
+    """
+    import asyncio
+    return asyncio.run(combined_analysis_async(text, claim, retrieved_docs))
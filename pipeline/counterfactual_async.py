@@ -3,25 +3,10 @@
 Async counterfactual reasoning module with optimized parsing.
 """
 
-import json
-import re
-import os
-from dotenv import load_dotenv
-from pathlib import Path
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-
-env_path = Path(__file__).resolve().parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-api_key = os.getenv("OPENROUTER_API_KEY")
-
-llm = ChatOpenAI(
-    api_key=api_key,
-    base_url="https://openrouter.ai/api/v1",
-    model="gpt-4o",
-    temperature=0
-)
+from langchain_core.messages import HumanMessage, SystemMessage
+from pipeline._config import ConfigError
+from pipeline._json_utils import safe_json_load
+from pipeline._llm import astream_json
 
 SYSTEM_PROMPT = """
 You are a counterfactual reasoning agent specialized in detecting identity-based implications.
@@ -63,27 +48,7 @@ Return ONLY valid JSON with the following fields:
 - explanation (string, explain why meaning is or isn't preserved)
 """
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("human", HUMAN_PROMPT),
-])
-
-
-def safe_json_load(text: str) -> dict:
-    """Extract and parse JSON from text."""
-    text = text.strip()
-    # Try direct JSON first (faster)
-    if text.startswith('{'):
-        try:
-            return json.loads(text)
-        except:
-            pass
-    
-    # Fallback to regex extraction
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in model output")
-    return json.loads(match.group())
+_SYSTEM_MSG = SystemMessage(content=SYSTEM_PROMPT)
 
 
 async def counterfactual_test_async(claim: str) -> dict:
@@ -103,11 +68,15 @@ async def counterfactual_test_async(claim: str) -> dict:
         - explanation: Explanation of why meaning is or isn't preserved
     """
     try:
-        response = await llm.ainvoke(
-            prompt.format_messages(claim=claim)
-        )
-
-        return safe_json_load(response.content)
+        content = await astream_json([
+            _SYSTEM_MSG,
+            HumanMessage(content=HUMAN_PROMPT.format(claim=claim)),
+        ])
+
+        return safe_json_load(content)
+    except ConfigError:
+        # Misconfiguration must surface, not score as low-risk
+        raise
     except Exception as e:
         return {
             "counterfactual_claim": "",
@@ -4,33 +4,11 @@ Claim extraction module.
 Extracts main claims from text and identifies targets and explicitness.
 """
 
-import json
-import os
-import re
-from dotenv import load_dotenv
-from pathlib import Path
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import HumanMessage, SystemMessage
+from pipeline._json_utils import safe_json_load
+from pipeline._llm import stream_json
 
 
-def safe_json_load(text: str) -> dict:
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in model output")
-    return json.loads(match.group())
-
-env_path = Path(__file__).resolve().parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-api_key = os.getenv("OPENROUTER_API_KEY")
-
-llm = ChatOpenAI(
-    api_key=api_key,
-    base_url="https://openrouter.ai/api/v1",
-    model="gpt-4o",
-    temperature=0
-)
-
 SYSTEM_PROMPT = """You are a linguistic analysis agent specialized in extracting claims and identifying targets.
 
 Your task is to:
@@ -69,10 +47,7 @@ Return ONLY valid JSON with:
 - explicitness (explicit | implicit): How directly identity is referenced
 """
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("human", HUMAN_PROMPT),
-])
+_SYSTEM_MSG = SystemMessage(content=SYSTEM_PROMPT)
 
 def extract_claim(text: str) -> dict:
     """Extract main claim and identify target from text.
@@ -90,5 +65,8 @@ def extract_claim(text: str) -> dict:
         - target: Target category (explicit_jews | implicit_jews | other | unclear)
         - explicitness: Explicitness level (explicit | implicit)
     """
-    response = llm.invoke(prompt.format_messages(text=text))
-    return safe_json_load(response.content)
\ No newline at end of file
+    content = stream_json([
+        _SYSTEM_MSG,
+        HumanMessage(content=HUMAN_PROMPT.format(text=text)),
+    ])
+    return safe_json_load(content)
\ No newline at end of file
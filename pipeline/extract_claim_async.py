@@ -3,25 +3,10 @@
 Async claim extraction module with optimized JSON parsing.
 """
 
-import json
-import os
-import re
-from dotenv import load_dotenv
-from pathlib import Path
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-
-env_path = Path(__file__).resolve().parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-api_key = os.getenv("OPENROUTER_API_KEY")
-
-llm = ChatOpenAI(
-    api_key=api_key,
-    base_url="https://openrouter.ai/api/v1",
-    model="gpt-4o",
-    temperature=0
-)
+from langchain_core.messages import HumanMessage, SystemMessage
+from pipeline._config import ConfigError
+from pipeline._json_utils import safe_json_load
+from pipeline._llm import astream_json
 
 SYSTEM_PROMPT = """You are a linguistic analysis agent specialized in extracting claims and identifying targets.
 
@@ -61,27 +46,7 @@ Return ONLY valid JSON with:
 - explicitness (explicit | implicit): How directly identity is referenced
 """
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("human", HUMAN_PROMPT),
-])
-
-
-def safe_json_load(text: str) -> dict:
-    """Extract and parse JSON from text."""
-    # Try direct JSON first (faster)
-    text = text.strip()
-    if text.startswith('{'):
-        try:
-            return json.loads(text)
-        except:
-            pass
-    
-    # Fallback to regex extraction
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in model output")
-    return json.loads(match.group())
+_SYSTEM_MSG = SystemMessage(content=SYSTEM_PROMPT)
 
 
 async def extract_claim_async(text: str) -> dict:
@@ -101,8 +66,14 @@ async def extract_claim_async(text: str) -> dict:
         - explicitness: Explicitness level (explicit | implicit)
     """
     try:
-        response = await llm.ainvoke(prompt.format_messages(text=text))
-        return safe_json_load(response.content)
+        content = await astream_json([
+            _SYSTEM_MSG,
+            HumanMessage(content=HUMAN_PROMPT.format(text=text)),
+        ])
+        return safe_json_load(content)
+    except ConfigError:
+        # Misconfiguration must surface, not score as low-risk
+        raise
     except Exception as e:
         # Return safe defaults on error
         return {
@@ -5,29 +5,9 @@ Trope mapping module.
 Maps claims to known antisemitic tropes using retrieved knowledge base context.
 """
 
-import json
-import re
-import os
-from dotenv import load_dotenv
-from pathlib import Path
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-
-
-# -----------------------------
-# LLM setup
-# -----------------------------
-env_path = Path(__file__).resolve().parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-api_key = os.getenv("OPENROUTER_API_KEY")
-
-llm = ChatOpenAI(
-    api_key=api_key,
-    base_url="https://openrouter.ai/api/v1",
-    model="gpt-4o",
-    temperature=0
-)
+from langchain_core.messages import HumanMessage, SystemMessage
+from pipeline._json_utils import safe_json_load
+from pipeline._llm import stream_json
 
 
 # -----------------------------
@@ -93,24 +73,7 @@ Return ONLY valid JSON with the following fields:
 - reasoning (string, brief explanation of your assessment)
 """
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("human", HUMAN_PROMPT),
-])
-
-
-# -----------------------------
-# Helper: safe JSON parsing
-# -----------------------------
-def safe_json_load(text: str) -> dict:
-    """
-    Extracts the first JSON object from a string and parses it.
-    Raises ValueError if no JSON is found.
-    """
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in model output")
-    return json.loads(match.group())
+_SYSTEM_MSG = SystemMessage(content=SYSTEM_PROMPT)
 
 
 # -----------------------------
@@ -142,21 +105,19 @@ def map_trope(claim: str, retrieved_docs) -> dict:
     )
 
     # Invoke LLM
-    response = llm.invoke(
-        prompt.format_messages(
-            claim=claim,
-            context=context
-        )
-    )
+    content = stream_json([
+        _SYSTEM_MSG,
+        HumanMessage(content=HUMAN_PROMPT.format(claim=claim, context=context)),
+    ])
 
     # Parse structured output safely
     try:
-        return safe_json_load(response.content)
+        return safe_json_load(content)
     except Exception as e:
         return {
             "mapped_trope": "none",
             "trope_strength": 0.0,
             "alternative_interpretation": "Unable to determine due to parsing error.",
             "error": str(e),
-            "raw_output": response.content
+            "raw_output": content
         }
@@ -3,25 +3,12 @@
 Async trope mapping module with optimized parsing.
 """
 
-import json
-import re
+import asyncio
 import os
-from dotenv import load_dotenv
-from pathlib import Path
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-
-env_path = Path(__file__).resolve().parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-api_key = os.getenv("OPENROUTER_API_KEY")
-
-llm = ChatOpenAI(
-    api_key=api_key,
-    base_url="https://openrouter.ai/api/v1",
-    model="gpt-4o",
-    temperature=0
-)
+from typing import Optional
+from pipeline._config import ConfigError, load_env
+from pipeline._json_utils import safe_json_load
+from pipeline._llm import chat_completion
 
 SYSTEM_PROMPT = """
 You are a contextual reasoning agent specialized in identifying antisemitic tropes.
@@ -83,27 +70,7 @@ Return ONLY valid JSON with the following fields:
 - reasoning (string, brief explanation of your assessment)
 """
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("human", HUMAN_PROMPT),
-])
-
-
-def safe_json_load(text: str) -> dict:
-    """Extract and parse JSON from text."""
-    text = text.strip()
-    # Try direct JSON first (faster)
-    if text.startswith('{'):
-        try:
-            return json.loads(text)
-        except:
-            pass
-    
-    # Fallback to regex extraction
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in model output")
-    return json.loads(match.group())
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
 
 
 async def map_trope_async(claim: str, retrieved_docs) -> dict:
@@ -131,25 +98,83 @@ async def map_trope_async(claim: str, retrieved_docs) -> dict:
     )
 
     try:
-        # Invoke LLM asynchronously
-        response = await llm.ainvoke(
-            prompt.format_messages(
-                claim=claim,
-                context=context
-            )
-        )
+        # Call the chat completions endpoint directly
+        content = await chat_completion([
+            _SYSTEM_MSG,
+            {"role": "user", "content": HUMAN_PROMPT.format(claim=claim, context=context)},
+        ])
 
         # Parse structured output safely
-        return safe_json_load(response.content)
+        return safe_json_load(content)
+    except ConfigError:
+        # Misconfiguration must surface, not score as low-risk
+        raise
     except Exception as e:
-        return {
-            "mapped_trope": "none",
-            "trope_strength": 0.0,
-            "alternative_interpretation": "Unable to determine due to parsing error.",
-            "reasoning": f"Error: {str(e)}",
-            "error": str(e),
-            "raw_output": str(e)
-        }
+        return _error_result(e)
+
+
+def _error_result(e: BaseException) -> dict:
+    """Build the fallback trope mapping returned when analysis fails."""
+    return {
+        "mapped_trope": "none",
+        "trope_strength": 0.0,
+        "alternative_interpretation": "Unable to determine due to parsing error.",
+        "reasoning": f"Error: {str(e)}",
+        "error": str(e),
+        "raw_output": str(e)
+    }
+
+
+def _default_max_concurrency() -> int:
+    """Default cap on concurrent LLM requests in map_tropes_batch_async.
+
+    Read from the environment on each batch, not at import, so importing
+    the module does not load .env.
+    """
+    load_env()
+    return int(os.getenv("MAP_TROPE_MAX_CONCURRENCY", "32"))
+
+
+async def map_tropes_batch_async(items, max_concurrency: Optional[int] = None) -> list[dict]:
+    """Map many claims to known antisemitic tropes concurrently (async version).
+
+    Parameters
+    ----------
+    items
+        Iterable of (claim, retrieved_docs) pairs, as accepted by
+        map_trope_async().
+    max_concurrency
+        Maximum number of LLM requests in flight at once (default: the
+        MAP_TROPE_MAX_CONCURRENCY environment variable, or 32).
+
+    Returns
+    -------
+    list[dict]
+        List of trope mapping results, one per item, in input order. A
+        failing item yields a fallback result without cancelling the batch.
+
+    Raises
+    ------
+    ConfigError
+        If the LLM client is misconfigured (e.g. the API key is missing).
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or _default_max_concurrency())
+
+    async def _map_one(claim, retrieved_docs):
+        async with semaphore:
+            return await map_trope_async(claim, retrieved_docs)
+
+    results = await asyncio.gather(
+        *(_map_one(claim, retrieved_docs) for claim, retrieved_docs in items),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, ConfigError):
+            raise result
+    return [
+        _error_result(result) if isinstance(result, BaseException) else result
+        for result in results
+    ]
 
 
 def map_trope(claim: str, retrieved_docs) -> dict:
@@ -171,6 +196,27 @@ def map_trope(claim: str, retrieved_docs) -> dict:
         - alternative_interpretation: Plausible non-antisemitic interpretation
         - reasoning: Brief explanation of assessment
     """
-    import asyncio
     return asyncio.run(map_trope_async(claim, retrieved_docs))
 
+
+def map_tropes_batch(items, max_concurrency: Optional[int] = None) -> list[dict]:
+    """Map many claims to known antisemitic tropes concurrently (synchronous wrapper).
+
+    Runs the whole batch on one event loop rather than calling
+    asyncio.run() once per claim.
+
+    Parameters
+    ----------
+    items
+        Iterable of (claim, retrieved_docs) pairs.
+    max_concurrency
+        Maximum number of LLM requests in flight at once (default: the
+        MAP_TROPE_MAX_CONCURRENCY environment variable, or 32).
+
+    Returns
+    -------
+    list[dict]
+        List of trope mapping results, one per item, in input order.
+    """
+    return asyncio.run(map_tropes_batch_async(items, max_concurrency))
+
@@ -5,35 +5,314 @@ Context retrieval module using RAG (Retrieval-Augmented Generation).
 Retrieves relevant knowledge base documents for trope identification.
 """
 
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from llama_index.core import (
+    SimpleDirectoryReader,
+    StorageContext,
+    VectorStoreIndex,
+    load_index_from_storage,
+)
+from llama_index.core.schema import NodeWithScore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from pipeline._config import load_env
 
-# Lazy loading - only initialize when first called
+try:
+    from llama_index.embeddings.huggingface_optimum import OptimumEmbedding
+    HAS_OPTIMUM = True
+except ImportError:
+    HAS_OPTIMUM = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
+try:
+    import torch
+    HAS_TORCH = True
+except ImportError:
+    HAS_TORCH = False
+
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Anchored at the repository root, not the working directory
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+KB_DIR = _REPO_ROOT / "kb"
+# The built index is persisted here and reused while the KB is unchanged
+INDEX_PERSIST_DIR = _REPO_ROOT / ".kb_index"
+_FINGERPRINT_FILE = "kb_fingerprint"
+# Number of KB documents returned per query
+SIMILARITY_TOP_K = 4
+
+# Built once, by prewarm() at application startup or by the first caller,
+# whichever gets the lock first
 _index = None
-_retriever = None
+_embed_model = None
+# KB nodes in row order; assigned last, it marks the retriever as ready
+_kb_nodes = None
+# Search backend, only one of which is built. With faiss installed: an exact
+# inner-product index over the unit-normalized float32 rows. Otherwise: the
+# rows quantized to int8 (one C-contiguous row per node, a quarter of the
+# float32 bytes for the memory-bound scan) with per-row float32 scales, for
+# topk_cosine. Quantization error can swap the order of near-tied documents,
+# so the two backends may rank such ties differently
+_faiss_index = None
+_kb_scales = None
+_kb_matrix = None
+_init_lock = threading.Lock()
+
+# Retrieval is local CPU work (MiniLM encode + vector scan), so async callers
+# share one long-lived executor instead of hopping through the default pool
+RETRIEVE_MAX_WORKERS = 4
+_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVE_MAX_WORKERS, thread_name_prefix="retrieve_context"
+)
+
+# LRU cache of ranked results for the most recent distinct queries
+RETRIEVE_CACHE_SIZE = 4096
+_retrieve_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_retrieve_cache_lock = threading.Lock()
+
+
+if HAS_NUMBA:
+    # Compiled once and cached on disk; nogil lets the retrieval executor's
+    # threads scan concurrently
+    @njit(cache=True, nogil=True, fastmath=True)
+    def topk_cosine(query, matrix, scales, k):
+        """Score every KB row against a query and return the k best, best first.
+
+        Parameters
+        ----------
+        query
+            Unit-normalized float32 query embedding of shape (dim,).
+        matrix
+            Unit-normalized KB embeddings quantized to int8, of shape (n, dim).
+        scales
+            float32 scale of each matrix row, of shape (n,).
+        k
+            Number of rows to return (fewer if the KB is smaller).
+
+        Returns
+        -------
+        tuple
+            Row indices and their cosine similarities, in descending order.
+            Scores are approximate (int8 rows), so near-tied rows may come
+            back in a different order than an exact float32 search.
+        """
+        n, dim = matrix.shape
+        scores = np.empty(n, dtype=np.float32)
+        for i in range(n):
+            acc = np.float32(0.0)
+            for j in range(dim):
+                acc += matrix[i, j] * query[j]
+            scores[i] = acc * scales[i]
+        order = np.argsort(-scores)[:k]
+        return order, scores[order]
+else:
+    def topk_cosine(query, matrix, scales, k):
+        """Score every KB row against a query and return the k best (NumPy version)."""
+        scores = (matrix @ query) * scales
+        order = np.argsort(-scores)[:k]
+        return order, scores[order]
 
 
 def _initialize_retriever():
-    """Initialize the retriever lazily (only when first needed)."""
-    global _index, _retriever
-    
-    if _retriever is not None:
-        return _retriever
-    
+    """Initialize the retriever once; concurrent callers wait for the same build."""
+    if _kb_nodes is not None:
+        return
+
+    with _init_lock:
+        if _kb_nodes is None:
+            _build_retriever()
+
+
+def _load_embed_model():
+    """Load the embedding model and return it with an identifier for fingerprinting.
+
+    Uses the ONNX (e.g. int8-quantized) export of the model in the directory
+    named by BLUESQUARE_ONNX_EMBED_DIR when set and
+    llama-index-embeddings-huggingface-optimum is installed, otherwise the
+    PyTorch MiniLM model, on the GPU when CUDA is available.
+    """
+    load_env()
+    onnx_embed_dir = os.getenv("BLUESQUARE_ONNX_EMBED_DIR")
+    if onnx_embed_dir:
+        if HAS_OPTIMUM:
+            return OptimumEmbedding(folder_name=onnx_embed_dir), f"onnx:{onnx_embed_dir}"
+        print("Warning: optimum embeddings not available. Falling back to PyTorch MiniLM.")
+    device = "cuda" if HAS_TORCH and torch.cuda.is_available() else "cpu"
+    return HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME, device=device), EMBED_MODEL_NAME
+
+
+def _kb_fingerprint(model_id: str) -> str:
+    """Hash the embedding model identifier and every KB file's path and contents."""
+    digest = hashlib.sha256(model_id.encode())
+    for path in sorted(p for p in KB_DIR.rglob("*") if p.is_file()):
+        digest.update(str(path.relative_to(KB_DIR)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _build_retriever():
+    """Load the embedding model and build the vector index over the KB."""
+    global _index, _embed_model
+
     # Local embedding model (no API key, no 429)
     print("Loading embedding model and building index...")
-    embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    
-    # Load KB
-    documents = SimpleDirectoryReader("kb").load_data()
-    
-    # Build vector index
-    _index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
-    # Increase top_k to get more relevant context
-    _retriever = _index.as_retriever(similarity_top_k=4)
-    
+    embed_model, model_id = _load_embed_model()
+
+    # Reuse the persisted index unless the KB (or embedding model) changed,
+    # which skips re-embedding every KB document on startup
+    fingerprint = _kb_fingerprint(model_id)
+    _index = _load_persisted_index(fingerprint, embed_model)
+    if _index is None:
+        # Load KB
+        documents = SimpleDirectoryReader(str(KB_DIR)).load_data()
+
+        # Build vector index
+        _index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
+        _persist_index(fingerprint)
+
+    _embed_model = embed_model
+    _stack_kb_embeddings()
+
     print("✓ Index ready!")
-    return _retriever
+
+
+def _load_persisted_index(fingerprint: str, embed_model):
+    """Load the persisted index if it was built for this fingerprint, else None."""
+    fingerprint_path = INDEX_PERSIST_DIR / _FINGERPRINT_FILE
+    try:
+        if fingerprint_path.read_text() != fingerprint:
+            return None
+        storage_context = StorageContext.from_defaults(persist_dir=str(INDEX_PERSIST_DIR))
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+    except (OSError, ValueError):
+        # Missing, or swapped out by another process mid-load; rebuild
+        return None
+
+
+def _persist_index(fingerprint: str):
+    """Persist the index with its fingerprint, replacing the old copy atomically.
+
+    The index is written to a staging directory that is renamed into place
+    only once complete, so processes starting together never read a
+    half-written index. The fingerprint is written inside the staging
+    directory, so it is only ever visible next to a complete index.
+    """
+    try:
+        staging = Path(tempfile.mkdtemp(
+            prefix=INDEX_PERSIST_DIR.name + ".", dir=INDEX_PERSIST_DIR.parent
+        ))
+    except OSError as e:
+        print(f"Warning: could not persist the KB index: {e}")
+        return
+    retired = staging.with_name(staging.name + ".old")
+    try:
+        _index.storage_context.persist(persist_dir=str(staging))
+        (staging / _FINGERPRINT_FILE).write_text(fingerprint)
+        try:
+            os.replace(INDEX_PERSIST_DIR, retired)
+        except FileNotFoundError:
+            pass
+        os.replace(staging, INDEX_PERSIST_DIR)
+    except OSError as e:
+        # Read-only checkout, or another process swapped its copy in first;
+        # the in-memory index is still usable
+        print(f"Warning: could not persist the KB index: {e}")
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(retired, ignore_errors=True)
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale vectors to unit L2 norm so a dot product is their cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _quantize_rows(matrix: np.ndarray) -> tuple:
+    """Quantize each row to int8 with its own max-abs scale."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales
+
+
+def _stack_kb_embeddings():
+    """Copy the index's KB embeddings into the top-k search structures."""
+    global _kb_nodes, _kb_scales, _kb_matrix, _faiss_index
+
+    embedding_dict = _index.vector_store.data.embedding_dict
+    node_ids = list(embedding_dict)
+    matrix = np.array([embedding_dict[node_id] for node_id in node_ids], dtype=np.float32)
+    matrix = np.ascontiguousarray(_normalize_rows(matrix), dtype=np.float32)
+    nodes = [_index.docstore.get_node(node_id) for node_id in node_ids]
+
+    if HAS_FAISS:
+        # Unit-norm rows make inner product equal to cosine similarity
+        faiss_index = faiss.IndexFlatIP(matrix.shape[1])
+        faiss_index.add(matrix)
+        _faiss_index = faiss_index
+    else:
+        _kb_matrix, _kb_scales = _quantize_rows(matrix)
+
+    _kb_nodes = nodes
+
+
+def _search(embeddings) -> list[tuple]:
+    """Rank KB nodes against each query embedding, most similar first."""
+    queries = np.ascontiguousarray(
+        _normalize_rows(np.asarray(embeddings, dtype=np.float32)), dtype=np.float32
+    )
+    if _faiss_index is not None:
+        scores, rows = _faiss_index.search(queries, SIMILARITY_TOP_K)
+        # faiss pads with -1 when the KB has fewer than SIMILARITY_TOP_K rows
+        ranked = [(order[order >= 0], score[order >= 0]) for order, score in zip(rows, scores)]
+    else:
+        ranked = [topk_cosine(query, _kb_matrix, _kb_scales, SIMILARITY_TOP_K) for query in queries]
+    return [
+        tuple(
+            NodeWithScore(node=_kb_nodes[i], score=float(score))
+            for i, score in zip(order, scores)
+        )
+        for order, scores in ranked
+    ]
+
+
+def _get_cached(query: str) -> Optional[tuple]:
+    """Get cached results for query, marking them as most recently used."""
+    with _retrieve_cache_lock:
+        results = _retrieve_cache.get(query)
+        if results is not None:
+            _retrieve_cache.move_to_end(query)
+        return results
+
+
+def _set_cached(query: str, results: tuple):
+    """Cache results for query, evicting the least recently used entry when full."""
+    with _retrieve_cache_lock:
+        if query in _retrieve_cache:
+            _retrieve_cache.move_to_end(query)
+        elif len(_retrieve_cache) >= RETRIEVE_CACHE_SIZE:
+            _retrieve_cache.popitem(last=False)
+        _retrieve_cache[query] = results
 
 
 def retrieve_context(query: str):
@@ -48,6 +327,59 @@ def retrieve_context(query: str):
     -------
     list
         List of retrieved document objects from knowledge base, ranked by relevance.
+        Results for repeated queries are served from an in-memory LRU cache.
+    """
+    results = _get_cached(query)
+    if results is None:
+        _initialize_retriever()
+        results = _search([_embed_model.get_query_embedding(query)])[0]
+        _set_cached(query, results)
+    # Copy so callers cannot mutate the cached entry
+    return list(results)
+
+
+async def retrieve_context_async(query: str):
+    """Retrieve relevant knowledge base documents without blocking the event loop (async version).
+
+    Parameters
+    ----------
+    query
+        Query text to search for in knowledge base.
+
+    Returns
+    -------
+    list
+        List of retrieved document objects from knowledge base, ranked by relevance.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, retrieve_context, query)
+
+
+def prewarm() -> bool:
+    """Compile the top-k kernel, load the embedding model and build the index.
+
+    Call once at application startup so the first query does not pay the
+    cold start. In a preforking server, call it in each worker after the
+    fork (e.g. gunicorn's post_fork hook): the build holds a lock that a
+    forked child would otherwise inherit in the locked state. Run it in a
+    thread to overlap the build with the rest of startup.
+
+    Returns
+    -------
+    bool
+        True if the retriever is ready, False if the build failed. Failures
+        are reported and left for the first query to retry.
     """
-    retriever = _initialize_retriever()
-    return retriever.retrieve(query)
+    try:
+        if HAS_NUMBA and not HAS_FAISS:
+            topk_cosine(
+                np.zeros(384, dtype=np.float32),
+                np.zeros((1, 384), dtype=np.int8),
+                np.ones(1, dtype=np.float32),
+                1,
+            )
+        _initialize_retriever()
+    except Exception as e:
+        print(f"Warning: retriever prewarm failed: {e}")
+        return False
+    return True